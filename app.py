@@ -3,15 +3,21 @@ NUTRIVERSE PRO - AI-Powered Nutrition Analysis Platform
 """
 
 import streamlit as st
-import google.generativeai as genai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sqlite3
-import json
+import threading
+import atexit
+import collections
+import contextlib
+import os
+import queue
+import io
+import orjson
+import re
 import uuid
-from datetime import datetime
-from PIL import Image
-import pandas as pd
-import plotly.express as px
+from datetime import datetime, timedelta
 import hashlib
 
 # ======================
@@ -38,12 +44,82 @@ config = AppConfig()
 # ======================
 # Database Layer
 # ======================
+def image_digest(image):
+    # BLAKE2b outruns SHA-256 on CPUs without SHA extensions; the digest is only a cache key
+    hasher = hashlib.blake2b(digest_size=32)
+    # Hash the upload in place rather than copying it out with getvalue()
+    with image.getbuffer() as view:
+        hasher.update(view)
+    return hasher.hexdigest()
+
 class DatabaseManager:
+    _INSERT_USER_SQL = "INSERT INTO users (id) VALUES (?)"
+    _SELECT_ANALYSIS_BY_HASH_SQL = """SELECT analysis_json FROM analyses
+        WHERE image_hash = ?
+        ORDER BY timestamp DESC LIMIT 1"""
+    _INSERT_ANALYSIS_SQL = """INSERT INTO analyses
+        (id, user_id, timestamp, image_hash, analysis_json)
+        VALUES (?, ?, ?, ?, ?)"""
+    # One fixed statement for any number of keys, so the statement cache always hits
+    _SELECT_FOODS_SQL = """SELECT query, food_json FROM nutrition_cache
+        WHERE query IN (SELECT value FROM json_each(?)) AND fetched_at > ?"""
+    _UPSERT_FOOD_SQL = """INSERT OR REPLACE INTO nutrition_cache
+        (query, food_json, fetched_at)
+        VALUES (?, ?, ?)"""
+    # Nutritionix values drift slowly; refetch a cached food after this long
+    _NUTRITION_TTL = timedelta(days=30)
+    # Seconds to hold new rows so bursts share one commit
+    _FLUSH_DELAY = 0.5
+    
     def __init__(self):
-        self.conn = sqlite3.connect(config.db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        # Shared across Streamlit's script threads, so serialize access ourselves
+        self.conn = sqlite3.connect(
+            config.db_path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._lock = threading.Lock()
+        self._pending_users = collections.deque()
+        self._pending_analyses = collections.deque()
+        self._pending_foods = {}
+        # Rows a flush is writing right now; lookups check them without waiting on the commit
+        self._flushing_analyses = collections.deque()
+        self._flushing_foods = {}
+        # Serializes flushes; held through the commit, so lookups never take it
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
         self._init_db()
+        # Read-only connections so lookups never wait behind the writer's lock
+        self._readers = queue.Queue()
+        for _ in range(os.cpu_count() or 4):
+            reader = sqlite3.connect(
+                f"file:{config.db_path}?mode=ro",
+                uri=True,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False
+            )
+            reader.execute("PRAGMA query_only=1")
+            self._readers.put(reader)
+        atexit.register(self._flush)
+    
+    @contextlib.contextmanager
+    def _reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
     
     def _init_db(self):
+        # WAL lets readers run alongside the writer and avoids a full fsync per commit
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-8000;
+            PRAGMA mmap_size=268435456;
+        """)
         with self.conn:
             self.conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -63,138 +139,345 @@ class DatabaseManager:
                     FOREIGN KEY(user_id) REFERENCES users(id)
                 )
             """)
+            # Covers the hash probe's ORDER BY so it reads a single index entry
+            self.conn.execute(
+                """CREATE INDEX IF NOT EXISTS idx_analyses_hash_ts
+                ON analyses(image_hash, timestamp DESC)"""
+            )
+            self.conn.execute(
+                """CREATE INDEX IF NOT EXISTS idx_analyses_user_ts
+                ON analyses(user_id, timestamp DESC)"""
+            )
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS nutrition_cache (
+                    query TEXT PRIMARY KEY,
+                    food_json TEXT,
+                    fetched_at TIMESTAMP
+                )
+            """)
     
     def create_user_session(self):
         user_id = str(uuid.uuid4())
-        with self.conn:
-            self.conn.execute(
-                "INSERT INTO users (id) VALUES (?)",
-                (user_id,)
-            )
+        with self._lock:
+            self._pending_users.append((user_id,))
+            self._schedule_flush()
         return user_id
     
-    def save_analysis(self, user_id, image, analysis):
-        image_hash = hashlib.sha256(image.getvalue()).hexdigest()
+    def get_analysis_by_hash(self, image_hash):
+        with self._lock:
+            # Rows still waiting for, or in the middle of, a flush count as stored
+            for rows in (self._pending_analyses, self._flushing_analyses):
+                for row in reversed(rows):
+                    if row[3] == image_hash:
+                        return orjson.loads(row[4])
+        with self._reader() as conn:
+            row = conn.execute(
+                self._SELECT_ANALYSIS_BY_HASH_SQL, (image_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            # Older rows came from json.dumps, which can write NaN; treat them as a miss
+            return None
+    
+    def save_analysis(self, user_id, image_hash, analysis):
         analysis_id = str(uuid.uuid4())
-        with self.conn:
-            self.conn.execute(
-                """INSERT INTO analyses 
-                (id, user_id, timestamp, image_hash, analysis_json)
-                VALUES (?, ?, ?, ?, ?)""",
-                (analysis_id, user_id, datetime.now(), image_hash, json.dumps(analysis))
+        with self._lock:
+            self._pending_analyses.append(
+                (analysis_id, user_id, datetime.now(), image_hash, orjson.dumps(analysis).decode())
             )
+            self._schedule_flush()
         return analysis_id
+    
+    def get_cached_foods(self, queries):
+        cutoff = datetime.now() - self._NUTRITION_TTL
+        with self._lock:
+            unsaved = {**self._flushing_foods, **self._pending_foods}
+        pending = [(query, unsaved[query][1]) for query in queries if query in unsaved]
+        with self._reader() as conn:
+            rows = conn.execute(
+                self._SELECT_FOODS_SQL, (orjson.dumps(list(queries)).decode(), cutoff)
+            ).fetchall()
+        # Pending rows are newer than anything on disk, so they go last and win
+        return {query: orjson.loads(food_json) for query, food_json in rows + pending}
+    
+    def save_cached_foods(self, foods):
+        now = datetime.now()
+        with self._lock:
+            for query, food in foods.items():
+                self._pending_foods[query] = (query, orjson.dumps(food).decode(), now)
+            self._schedule_flush()
+    
+    def _schedule_flush(self):
+        # Caller holds self._lock
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self._FLUSH_DELAY, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _flush(self):
+        with self._write_lock:
+            with self._lock:
+                self._flush_timer = None
+                users = self._pending_users
+                analyses = self._pending_analyses
+                foods = self._pending_foods
+                if not (users or analyses or foods):
+                    return
+                # Hand the batch over so new rows queue up while it is written
+                self._pending_users = collections.deque()
+                self._pending_analyses = collections.deque()
+                self._pending_foods = {}
+                self._flushing_analyses = analyses
+                self._flushing_foods = foods
+            try:
+                # Take SQLite's write lock up front so a concurrent writer can't force a retry mid-batch
+                self.conn.execute("BEGIN IMMEDIATE")
+                # Users first so analyses never reference a row that isn't there yet
+                self.conn.executemany(self._INSERT_USER_SQL, users)
+                self.conn.executemany(self._INSERT_ANALYSIS_SQL, analyses)
+                self.conn.executemany(self._UPSERT_FOOD_SQL, foods.values())
+                self.conn.execute("COMMIT")
+            except Exception:
+                # SQLite may already have rolled back on its own; never leave the writer mid-transaction
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                # Put the batch back ahead of anything queued since, so the next flush retries it
+                with self._lock:
+                    users.extend(self._pending_users)
+                    analyses.extend(self._pending_analyses)
+                    foods.update(self._pending_foods)
+                    self._pending_users = users
+                    self._pending_analyses = analyses
+                    self._pending_foods = foods
+                    self._flushing_analyses = collections.deque()
+                    self._flushing_foods = {}
+                raise
+            with self._lock:
+                self._flushing_analyses = collections.deque()
+                self._flushing_foods = {}
+
+@st.cache_resource
+def get_db():
+    return DatabaseManager()
 
 # ======================
 # AI Service Layer
 # ======================
+_PROMPT = """Analyze this food image and output JSON with:
+        - main_dish: {name, cultural_origin}
+        - ingredients: [{name, quantity, unit}]
+        - nutrition: {calories, protein, carbs, fat, vitamins}
+        - health_metrics: {score (0-100), allergens}
+        - sustainability: {carbon_footprint, alternatives}
+        """
+
+# Food recognition doesn't need more than this on the long edge
+_MAX_IMAGE_EDGE = 1024
+_JPEG_QUALITY = 85
+
+# Markdown code fences Gemini wraps around its JSON
+_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.S)
+
 class NutritionAI:
     def __init__(self):
+        # Imported here so cache hits and idle sessions never load the SDK
+        import google.generativeai as genai
         genai.configure(api_key=config.gemini_key)
         self.model = genai.GenerativeModel('gemini-1.5-pro')
     
-    def analyze_image(self, image):
+    def analyze_image(self, image, progress=None):
         try:
             response = self.model.generate_content([
                 self._build_prompt(),
-                Image.open(image)
-            ])
-            return self._parse_response(response.text)
+                self._prepare_image(image)
+            ], stream=True)
+            # Show the reply as it arrives instead of blocking on the whole blob
+            chunks = []
+            for chunk in response:
+                chunks.append(chunk.text)
+                if progress is not None:
+                    progress.caption(f"…{chunk.text[-40:]}")
+            response.resolve()
+            analysis = self._parse_response("".join(chunks))
+            if analysis is None:
+                st.error("Failed to parse AI response")
+            return analysis
         except Exception as e:
             st.error(f"AI Analysis Error: {str(e)}")
             return None
+        finally:
+            if progress is not None:
+                progress.empty()
+    
+    def _prepare_image(self, image):
+        from PIL import Image
+        # Phone photos are several MB; a downscaled JPEG uploads and tokenizes much faster
+        img = Image.open(image)
+        img.thumbnail((_MAX_IMAGE_EDGE, _MAX_IMAGE_EDGE), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.convert('RGB').save(buf, 'JPEG', quality=_JPEG_QUALITY, optimize=True)
+        return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
     
     def _build_prompt(self):
-        return """Analyze this food image and output JSON with:
-        - main_dish: {name, cultural_origin}
-        - ingredients: [{name, quantity, unit}]
-        - nutrition: {calories, protein, carbs, fat, vitamins}
-        - health_metrics: {score (0-100), allergens}
-        - sustainability: {carbon_footprint, alternatives}
-        """
+        return _PROMPT
     
     def _parse_response(self, text):
-        cleaned = text.replace('```json', '').replace('```', '').strip()
+        # The JSON object spans the first '{' to the last '}', fences or not
+        start = text.find('{')
+        end = text.rfind('}') + 1
         try:
-            return json.loads(cleaned)
-        except json.JSONDecodeError:
-            st.error("Failed to parse AI response")
-            return None
+            result = orjson.loads(text[start:end])
+        except orjson.JSONDecodeError:
+            match = _FENCE_RE.search(text)
+            try:
+                result = orjson.loads(match.group(1) if match else text)
+            except orjson.JSONDecodeError:
+                return None
+        # Valid JSON that isn't an object (a list, a bare string) can't be rendered or saved
+        return result if isinstance(result, dict) else None
+
+@st.cache_resource
+def get_ai():
+    return NutritionAI()
 
 # ======================
 # Nutrition API Layer
 # ======================
+_NUTRITIONIX_URL = "https://trackapi.nutritionix.com/v2/natural/nutrients"
+_HEADERS_TEMPLATE = {"Content-Type": "application/json"}
+
+def ingredient_columns(ingredients):
+    # Split Gemini's list of ingredient dicts into aligned columns, once per analysis
+    return {
+        'names': [item.get('name', '') for item in ingredients],
+        'quantities': [item.get('quantity', '') for item in ingredients],
+        'units': [item.get('unit', '') for item in ingredients]
+    }
+
 class NutritionAPI:
-    def __init__(self):
+    def __init__(self, cache=None):
+        # Optional persistent per-ingredient store (a DatabaseManager)
+        self.cache = cache
         self.headers = {
+            **_HEADERS_TEMPLATE,
             "x-app-id": config.nutritionix_id,
-            "x-app-key": config.nutritionix_key,
-            "Content-Type": "application/json"
+            "x-app-key": config.nutritionix_key
         }
+        # Pooled session so keep-alive and TLS resumption carry across requests
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # One instance serves every session, so size the pool for concurrent users
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                allowed_methods=None,
+                status_forcelist=(429, 500, 502, 503, 504)
+            )
+        ))
     
-    def get_detailed_nutrition(self, item):
-        try:
-            response = requests.post(
-                "https://trackapi.nutritionix.com/v2/natural/nutrients",
-                headers=self.headers,
-                json={"query": f"{item['quantity']}{item['unit']} {item['name']}"}
+    def get_bulk_nutrition(self, columns):
+        if not columns['names']:
+            return []
+        # Normalized so "1cup Rice" and "1cup  rice" share a cache entry
+        lines = [
+            " ".join(f"{quantity}{unit} {name}".lower().split())
+            for quantity, unit, name in zip(
+                columns['quantities'], columns['units'], columns['names']
             )
-            return response.json().get('foods', [{}])[0] if response.ok else {}
+        ]
+        foods_by_line = self.cache.get_cached_foods(set(lines)) if self.cache else {}
+        cached = [foods_by_line[line] for line in lines if line in foods_by_line]
+        # Sorted so the same ingredients in a different order share a query
+        missing = sorted(line for line in lines if line not in foods_by_line)
+        if not missing:
+            return cached
+        try:
+            foods = _fetch_foods(self.session, "\n".join(missing))
         except Exception as e:
             st.error(f"Nutrition API Error: {str(e)}")
-            return {}
+            # Report the failure rather than empty foods, so it isn't memoized as zero nutrients
+            return None
+        # Nutritionix may split a line into several foods or drop it, and no field of a
+        # food names its line, so only a lone line answered by a lone food is attributable
+        if self.cache and len(missing) == 1 and len(foods) == 1:
+            self.cache.save_cached_foods({missing[0]: foods[0]})
+        return cached + foods
+
+@st.cache_data(ttl=86400, max_entries=1000, show_spinner=False)
+def _fetch_foods(_session, query):
+    response = _session.post(_NUTRITIONIX_URL, json={"query": query}, timeout=5)
+    # 404 means none of the lines matched a food, which is a valid answer
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return response.json().get('foods', [])
+
+@st.cache_resource
+def get_api():
+    return NutritionAPI(cache=get_db())
 
 # ======================
 # Presentation Layer
 # ======================
+NUTRIENT_FIELDS = (
+    'nf_calories',
+    'nf_protein',
+    'nf_total_carbohydrate',
+    'nf_total_fat',
+    'nf_calcium_dv',
+    'nf_iron_dv',
+    'nf_potassium',
+    'nf_vitamin_c_dv'
+)
+
+# Whole-app style sheet, kept compact because it is re-sent on every rerun
+_GLOBAL_CSS = (
+    "<style>"
+    ".main{background:#f8fafc}"
+    ".food-card{border-radius:15px;padding:2rem;background:white;"
+    "box-shadow:0 4px 6px -1px rgba(0,0,0,0.1);margin:1rem 0}"
+    ".metric-badge{padding:1rem;border-radius:8px;background:#f1f5f9;text-align:center}"
+    "</style>"
+)
+
+def aggregate_nutrients(nutrition_data):
+    # One pass over the foods instead of a separate sum() per nutrient
+    totals = dict.fromkeys(NUTRIENT_FIELDS, 0)
+    for item in nutrition_data:
+        for field in NUTRIENT_FIELDS:
+            # Nutritionix reports unknown values as null
+            totals[field] += item.get(field) or 0
+    return totals
+
 class NutritionDashboard:
-    def __init__(self):
-        self._load_assets()
+    def load_assets(self):
+        # Streamlit drops elements that a rerun doesn't emit, so this must run every rerun
+        st.markdown(_GLOBAL_CSS, unsafe_allow_html=True)
     
-    def _load_assets(self):
-        st.markdown("""
-        <style>
-        .main {
-            background: #f8fafc;
-        }
-        .food-card {
-            border-radius: 15px;
-            padding: 2rem;
-            background: white;
-            box-shadow: 0 4px 6px -1px rgba(0,0,0,0.1);
-            margin: 1rem 0;
-        }
-        .metric-badge {
-            padding: 1rem;
-            border-radius: 8px;
-            background: #f1f5f9;
-            text-align: center;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-    
-    def show_analysis(self, analysis, nutrition_data):
+    def show_analysis(self, analysis):
+        # Nutrition totals arrive later; hand back slots for show_nutrition to fill
         with st.container():
+            main_dish = analysis.get('main_dish', {})
+            health_metrics = analysis.get('health_metrics', {})
+            
             # Header Section
-            st.subheader(f"🍴 {analysis.get('main_dish', {}).get('name', 'Unknown Dish')}")
-            st.caption(f"Cuisine: {analysis.get('main_dish', {}).get('cultural_origin', '')}")
+            st.subheader(f"🍴 {main_dish.get('name', 'Unknown Dish')}")
+            st.caption(f"Cuisine: {main_dish.get('cultural_origin', '')}")
             
             # Health Metrics
             cols = st.columns(3)
-            health_score = analysis.get('health_metrics', {}).get('score', 0)
-            cols[0].metric("Health Score", f"{health_score}/100")
-            cols[1].metric("Calories", sum(item.get('nf_calories', 0) for item in nutrition_data))
-            cols[2].metric("Allergens", ", ".join(analysis.get('health_metrics', {}).get('allergens', [])) or "None")
+            cols[0].metric("Health Score", f"{health_metrics.get('score', 0)}/100")
+            calories_slot = cols[1].empty()
+            cols[2].metric("Allergens", ", ".join(health_metrics.get('allergens', [])) or "None")
             
             # Nutrition Visualization
-            with st.expander("📊 Detailed Nutrition Analysis", expanded=True):
-                tab1, tab2 = st.tabs(["Macronutrients", "Micronutrients"])
-                
-                with tab1:
-                    self._show_macros(nutrition_data)
-                
-                with tab2:
-                    self._show_micros(nutrition_data)
+            nutrition_slot = st.empty()
             
             # Sustainability
             with st.container():
@@ -202,43 +485,130 @@ class NutritionDashboard:
                 sustainability = analysis.get('sustainability', {})
                 cols = st.columns(2)
                 cols[0].metric("Carbon Footprint", f"{sustainability.get('carbon_footprint', 0)}g CO2")
-                cols[1].metric("Eco Alternatives", len(sustainability.get('alternatives', [])))
+                alternatives = sustainability.get('alternatives', [])
+                cols[1].metric("Eco Alternatives", len(alternatives))
                 
-                if sustainability.get('alternatives'):
-                    st.write("**Sustainable Swaps:**")
-                    for alt in sustainability['alternatives']:
-                        st.write(f"- {alt}")
+                if alternatives:
+                    # One markdown block instead of a render message per swap
+                    st.markdown("**Sustainable Swaps:**\n" + "".join(
+                        f"\n- {alt}" for alt in alternatives
+                    ))
+        
+        return calories_slot, nutrition_slot
     
-    def _show_macros(self, data):
-        df = pd.DataFrame({
-            'Macro': ['Protein', 'Carbs', 'Fat'],
-            'Grams': [
-                sum(item.get('nf_protein', 0) for item in data),
-                sum(item.get('nf_total_carbohydrate', 0) for item in data),
-                sum(item.get('nf_total_fat', 0) for item in data)
-            ]
-        })
-        fig = px.pie(df, values='Grams', names='Macro', hole=0.4)
+    def show_nutrition(self, slots, totals):
+        calories_slot, nutrition_slot = slots
+        calories_slot.metric("Calories", totals['nf_calories'])
+        
+        with nutrition_slot.container():
+            with st.expander("📊 Detailed Nutrition Analysis", expanded=True):
+                tab1, tab2 = st.tabs(["Macronutrients", "Micronutrients"])
+                
+                with tab1:
+                    self._show_macros(totals)
+                
+                with tab2:
+                    self._show_micros(totals)
+    
+    def _show_macros(self, totals):
+        fig = _macro_pie(
+            totals['nf_protein'],
+            totals['nf_total_carbohydrate'],
+            totals['nf_total_fat']
+        )
         st.plotly_chart(fig, use_container_width=True)
     
-    def _show_micros(self, data):
+    def _show_micros(self, totals):
         micros = {
-            'Calcium': sum(item.get('nf_calcium_dv', 0) for item in data),
-            'Iron': sum(item.get('nf_iron_dv', 0) for item in data),
-            'Potassium': sum(item.get('nf_potassium', 0) for item in data),
-            'Vitamin C': sum(item.get('nf_vitamin_c_dv', 0) for item in data)
+            'Calcium': totals['nf_calcium_dv'],
+            'Iron': totals['nf_iron_dv'],
+            'Potassium': totals['nf_potassium'],
+            'Vitamin C': totals['nf_vitamin_c_dv']
         }
         st.bar_chart(micros)
 
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _macro_pie(protein, carbs, fat):
+    # Deferred so sessions that never reach a chart skip the plotly import;
+    # graph_objects skips the DataFrame plotly.express builds from plain lists
+    import plotly.graph_objects as go
+    return go.Figure(go.Pie(
+        values=[protein, carbs, fat],
+        labels=['Protein', 'Carbs', 'Fat'],
+        hole=0.4
+    ))
+
+@st.cache_resource
+def get_ui():
+    return NutritionDashboard()
+
 # ======================
 # Application Core
 # ======================
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+@st.fragment
+def analysis_panel(uploaded_file):
+    # The panel has no widgets of its own yet, so it still reruns with the page;
+    # as a fragment, controls added here later will rerun only the panel
+    db = get_db()
+    nutrition_api = get_api()
+    ui = get_ui()
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.image(uploaded_file, use_container_width=True)
+    
+    with col2:
+        image_hash = image_digest(uploaded_file)
+        last_result = st.session_state.get('last_result')
+        
+        # Reruns of the same upload reuse this session's result outright
+        if last_result and last_result[0] == image_hash:
+            _, analysis, totals = last_result
+        else:
+            totals = None
+            with st.spinner("🔍 Analyzing nutritional composition..."):
+                # Reuse a previous analysis of the same image when we have one
+                analysis = db.get_analysis_by_hash(image_hash)
+                
+                # A stored non-object reply is treated as a miss and re-analyzed
+                if not isinstance(analysis, dict):
+                    # AI Analysis
+                    analysis = get_ai().analyze_image(uploaded_file, progress=st.empty())
+                    
+                    # Save to Database (buffered, flushed in the background)
+                    if analysis:
+                        db.save_analysis(
+                            st.session_state.user_id,
+                            image_hash,
+                            analysis
+                        )
+        
+        if analysis:
+            # Display what Gemini found while Nutritionix is still being queried
+            slots = ui.show_analysis(analysis)
+            
+            if totals is None:
+                with st.spinner("🥗 Fetching nutrition facts..."):
+                    # Nutrition API Data
+                    nutrition_data = nutrition_api.get_bulk_nutrition(
+                        ingredient_columns(analysis.get('ingredients', []))
+                    )
+                # Only a successful lookup is memoized; a failed one is retried next rerun
+                if nutrition_data is not None:
+                    totals = aggregate_nutrients(nutrition_data)
+                    st.session_state.last_result = (image_hash, analysis, totals)
+            
+            if totals is not None:
+                ui.show_nutrition(slots, totals)
+
 def main():
     # Initialize services
-    db = DatabaseManager()
-    ai = NutritionAI()
-    nutrition_api = NutritionAPI()
-    ui = NutritionDashboard()
+    db = get_db()
+    ui = get_ui()
+    ui.load_assets()
     
     # User Session Management
     if 'user_id' not in st.session_state:
@@ -247,33 +617,10 @@ def main():
     st.title("🍎 Nutriverse - AI Nutrition Analyst")
     uploaded_file = st.file_uploader("Upload Food Image", type=["jpg", "png", "jpeg"])
     
-    if uploaded_file:
-        col1, col2 = st.columns([1, 2])
-        
-        with col1:
-            st.image(uploaded_file, use_container_width=True)
-        
-        with col2:
-            with st.spinner("🔍 Analyzing nutritional composition..."):
-                # AI Analysis
-                analysis = ai.analyze_image(uploaded_file)
-                
-                if analysis:
-                    # Nutrition API Data
-                    nutrition_data = [
-                        nutrition_api.get_detailed_nutrition(item)
-                        for item in analysis.get('ingredients', [])
-                    ]
-                    
-                    # Save to Database
-                    db.save_analysis(
-                        st.session_state.user_id,
-                        uploaded_file,
-                        analysis
-                    )
-                    
-                    # Display Results
-                    ui.show_analysis(analysis, nutrition_data)
+    if uploaded_file and uploaded_file.size > MAX_UPLOAD_BYTES:
+        st.error(f"Image too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+    elif uploaded_file:
+        analysis_panel(uploaded_file)
 
 if __name__ == "__main__":
     main()